@@ -1,9 +1,12 @@
 from app.services.anomalyDetectorManager import AnomalyDetectorManager, LogRequest
 from fastapi import APIRouter, Body
+from fastapi.responses import ORJSONResponse
 from typing import List
 import logging
 from app.schemas.anomaly import AnomalyRequest, AnomalyReport, DetectedAnomaly
 from app.services import anomalyDetector
+from app.services.redisMicroBatcher import redisBatcher
+from redis.asyncio.client import Pipeline
 
 # Get a logger for this module
 logger = logging.getLogger(__name__)
@@ -13,13 +16,22 @@ model_manager = AnomalyDetectorManager()
 
 router = APIRouter()
 
+# Score contributed by each rule-based anomaly type; model anomalies score their reconstruction error
+anomalyScores = {
+    "INCREASED_REQUEST_RATE": 0.9,
+    "REPETITIVE_REQUEST": 0.95,
+    "COLLECTIVE_LATENCY_SPIKE": 0.85,
+    "INCREASED_CLIENT_ERROR_RATE": 0.9,
+    "INCREASED_SERVER_ERROR_RATE": 0.98,
+}
+
 
 @router.post("/analyze")
-def analyze_log(request: LogRequest):
+async def analyze_log(request: LogRequest):
     """
     Analyzes a single log entry for anomalies and adapts the model if necessary.
     """
-    result = model_manager.handle_incoming_log(request.log_text)
+    result = await model_manager.handle_incoming_log(request.log_text)
     return result
 
 @router.get("/")
@@ -28,59 +40,59 @@ def read_root():
 
 @router.post("/predict", response_model=AnomalyReport)
 async def predict_anomaly(anomalyRequest: AnomalyRequest = Body(...)):
-    logger.info(f"Received prediction request: {anomalyRequest.requestId} for endpoint {anomalyRequest.endpoint}")
+    logger.info("Received prediction request: %s for endpoint %s", anomalyRequest.requestId, anomalyRequest.endpoint)
     
     detectedAnomalies: List[DetectedAnomaly] = []
 
     # Check here REQUEST or REQUESTANDRESPONSE and do check accordingly
     
-    reconstructionError = anomalyDetector.getAutoEncoderReconstructionError(anomalyRequest)
+    # Queue every detector's Redis commands on the shared pipeline of concurrent requests
+    async def queueDetectors(pipe: Pipeline):
+        evaluateReconstructionError = anomalyDetector.getAutoEncoderReconstructionError(anomalyRequest, pipe)
+        evaluators = [
+            anomalyDetector.checkSuddenSpikesInRequests(anomalyRequest, pipe),
+            anomalyDetector.checkRepetitiveRequestsByUsers(anomalyRequest, pipe),
+            anomalyDetector.checkDelayResponseSpikes(anomalyRequest, pipe),
+            anomalyDetector.checkErrorRateSpike(anomalyRequest, pipe),
+        ]
+        return evaluateReconstructionError, evaluators
+
+    (evaluateReconstructionError, evaluators), results = await redisBatcher.submit(queueDetectors)
+
+    reconstructionError = evaluateReconstructionError(results)
     anomalyScore = reconstructionError
     
     if reconstructionError > 0.8:
-        anomaly = DetectedAnomaly(
+        detectedAnomalies.append(DetectedAnomaly.model_construct(
             type="LATENCY_SPIKE_OR_NEW_SCHEMA",
             reason=f"High reconstruction error ({reconstructionError:.2f}) from model. Response time: {anomalyRequest.responseTime}ms."
-        )
-        detectedAnomalies.append(anomaly)
-        logger.warning(f"Anomaly detected: {anomaly.type} for request {anomalyRequest.requestId}")
-
-    rateAnomaly = anomalyDetector.checkSuddenSpikesInRequests(anomalyRequest)
-    if rateAnomaly:
-        detectedAnomalies.append(rateAnomaly)
-        anomalyScore = max(anomalyScore, 0.9)
-        logger.warning(f"Anomaly detected: {rateAnomaly.type} for request {anomalyRequest.requestId}")
-
-    repetitiveAnomaly = anomalyDetector.checkRepetitiveRequestsByUsers(anomalyRequest)
-    if repetitiveAnomaly:
-        detectedAnomalies.append(repetitiveAnomaly)
-        anomalyScore = max(anomalyScore, 0.95)
-        logger.warning(f"Anomaly detected: {repetitiveAnomaly.type} for request {anomalyRequest.requestId}")
-
-    collectiveLatencyAnomaly = anomalyDetector.checkDelayResponseSpikes(anomalyRequest)
-    if collectiveLatencyAnomaly:
-        detectedAnomalies.append(collectiveLatencyAnomaly)
-        anomalyScore = max(anomalyScore, 0.85)
-        logger.warning(f"Anomaly detected: {collectiveLatencyAnomaly.type} for request {anomalyRequest.requestId}")
-
-    errorAnomalies = anomalyDetector.checkErrorRateSpike(anomalyRequest)
-    for errorAnomaly in errorAnomalies:
-        detectedAnomalies.append(errorAnomaly)
-        anomalyScore = max(anomalyScore, 0.98 if "SERVER" in errorAnomaly.type else 0.9)
-        logger.warning(f"Anomaly detected: {errorAnomaly.type} for request {anomalyRequest.requestId}")
+        ))
+
+    for evaluate in evaluators:
+        outcome = evaluate(results)
+        if isinstance(outcome, list):
+            detectedAnomalies.extend(outcome)
+        elif outcome:
+            detectedAnomalies.append(outcome)
+
+    for anomaly in detectedAnomalies:
+        anomalyScore = max(anomalyScore, anomalyScores.get(anomaly.type, reconstructionError))
+        logger.warning("Anomaly detected: %s for request %s", anomaly.type, anomalyRequest.requestId)
 
     isAnomaly = len(detectedAnomalies) > 0
 
-    finalReport = AnomalyReport(
+    finalReport = AnomalyReport.model_construct(
         requestId=anomalyRequest.requestId,
         isAnomaly=isAnomaly,
         anomalyScore=min(1.0, anomalyScore),
         detectedAnomalies=detectedAnomalies
     )
 
-    if finalReport.isAnomaly:
-        logger.info(f"Final report for {anomalyRequest.requestId}: ANOMALY DETECTED with score {finalReport.anomalyScore:.2f}")
-    else:
-        logger.info(f"Final report for {anomalyRequest.requestId}: No anomaly detected.")
-        
-    return finalReport
+    if logger.isEnabledFor(logging.INFO):
+        if finalReport.isAnomaly:
+            logger.info("Final report for %s: ANOMALY DETECTED with score %.2f", anomalyRequest.requestId, finalReport.anomalyScore)
+        else:
+            logger.info("Final report for %s: No anomaly detected.", anomalyRequest.requestId)
+
+    # The report is built from trusted values, so skip re-validating it against response_model
+    return ORJSONResponse(finalReport.model_dump())
@@ -1,5 +1,16 @@
-import redis
+from redis.asyncio import BlockingConnectionPool, Redis
 
 # Connect to Redis. Ensure Redis is running on localhost:6379
 # For production, use a more robust configuration management.
-redisClient = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+# One pool per process; requests wait for a free connection instead of failing under bursts.
+# Replies are left undecoded: the detectors only read numeric counters, so no reply needs a str.
+redisPool = BlockingConnectionPool(
+    host='localhost',
+    port=6379,
+    db=0,
+    max_connections=64,
+    socket_keepalive=True,
+    decode_responses=False,
+    protocol=3
+)
+redisClient = Redis(connection_pool=redisPool)
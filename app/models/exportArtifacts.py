@@ -0,0 +1,37 @@
+"""
+Converts the pickled training artifact into the files AnomalyDetectorManager loads:
+the autoencoder weights and initial normals as safetensors, and the threshold and
+known endpoints as JSON.
+
+Usage: python -m app.models.exportArtifacts [path/to/anomaly_model_state.pth]
+"""
+import json
+import sys
+import numpy as np
+import torch
+from safetensors.torch import save_file
+
+def export_artifacts(source_path="app/models/anomaly_model_state.pth",
+                     model_path="app/models/anomaly_model.safetensors",
+                     metadata_path="app/models/anomaly_model.json"):
+    # The training artifact pickles a numpy scalar threshold and a set of endpoints next to the tensors.
+    # numpy >= 2 moved numpy.core to numpy._core
+    numpy_core = getattr(np, "_core", None) or np.core
+    with torch.serialization.safe_globals([numpy_core.multiarray.scalar, np.dtype, type(np.dtype(np.float32)), set]):
+        artifacts = torch.load(source_path, map_location="cpu", weights_only=True)
+
+    tensors = dict(artifacts['autoencoder_state_dict'])
+    tensors['initial_normals'] = artifacts['initial_normals']
+    save_file({name: tensor.contiguous() for name, tensor in tensors.items()}, model_path)
+
+    metadata = {
+        "anomaly_threshold": float(artifacts['anomaly_threshold']),
+        "known_endpoints": sorted(artifacts['known_endpoints']),
+    }
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f, indent=4)
+        f.write("\n")
+    print(f"✅ Exported {len(tensors)} tensors to {model_path} and metadata to {metadata_path}.")
+
+if __name__ == "__main__":
+    export_artifacts(*sys.argv[1:2])
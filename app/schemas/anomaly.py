@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from functools import cached_property
 import datetime
 from typing import List
 import uuid
@@ -9,10 +10,15 @@ class AnomalyRequest(BaseModel):
     endpoint: str
     httpMethod: str
     statusCode: int
-    responseTime: float
+    responseTime: float = Field(allow_inf_nan=False)
     authCompanyId: str
     schemaHash: str
 
+    @cached_property
+    def epochSeconds(self) -> float:
+        """POSIX seconds of the timestamp, converted at most once per request"""
+        return self.timestamp.timestamp()
+
 class DetectedAnomaly(BaseModel):
     type: str
     reason: str
@@ -1,144 +1,257 @@
-from typing import Optional, List
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Optional, List, Tuple
+from redis.asyncio.client import Pipeline
 from app.schemas.anomaly import AnomalyRequest, DetectedAnomaly
 from app.config.redis import redisClient
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Process-local LRU of (endpoint, schemaHash) pairs Redis has already confirmed.
+# A hit skips the schema command; a miss always asks Redis, which stays the
+# source of truth across workers.
+schemaCacheSize = 131072
+_confirmedSchemas: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+def _isSchemaConfirmed(endpoint: str, schemaHash: str) -> bool:
+    key = (endpoint, schemaHash)
+    if key not in _confirmedSchemas:
+        return False
+    _confirmedSchemas.move_to_end(key)
+    return True
+
+def _confirmSchema(endpoint: str, schemaHash: str) -> None:
+    _confirmedSchemas[(endpoint, schemaHash)] = None
+    if len(_confirmedSchemas) > schemaCacheSize:
+        _confirmedSchemas.popitem(last=False)
+
+# Key builders for the per-endpoint counters, cached so each key is formatted and
+# encoded once instead of on every request
+@lru_cache(maxsize=4096)
+def _schemaKey(endpoint: str) -> bytes:
+    return f"schema_hashes:{endpoint}".encode()
+
+@lru_cache(maxsize=4096)
+def _rateKey(endpoint: str) -> bytes:
+    return f"rate:{endpoint}".encode()
+
+@lru_cache(maxsize=65536)
+def _repetitiveKey(companyId: str, endpoint: str) -> bytes:
+    return f"rep:{companyId}:{endpoint}".encode()
+
+@lru_cache(maxsize=4096)
+def _latencyKeys(endpoint: str) -> Tuple[bytes, bytes]:
+    return f"latency_samples:{endpoint}".encode(), f"latency_sum:{endpoint}".encode()
+
+# Counts hits in a fixed window that starts with the first INCR; only that first
+# hit sets the TTL, so one key per counter is reused instead of one per minute.
+# The threshold is compared server-side and returned as {count, exceeded}.
+fixedWindowScript = redisClient.register_script("""
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+if count > tonumber(ARGV[2]) then
+    return {count, 1}
+end
+return {count, 0}
+""")
+
+# Pushes a latency sample onto a fixed-size window and keeps a running sum of the
+# window next to it, returning {sum, length} so the average costs O(1) to read.
+# Scripts are not rolled back on error, so every input is checked and the sum is
+# updated before the list: a rejected call leaves both keys untouched.
+latencyWindowScript = redisClient.register_script("""
+local sample = tonumber(ARGV[1])
+if not sample or sample ~= sample or sample == math.huge or sample == -math.huge then
+    return redis.error_reply('latency sample must be a finite number')
+end
+local maxLength = tonumber(ARGV[2])
+local windowLength = redis.call('LLEN', KEYS[1]) + 1
+local delta = sample
+if windowLength > maxLength then
+    local oldest = tonumber(redis.call('LINDEX', KEYS[1], -1))
+    if not oldest then
+        return redis.error_reply('latency window holds a non-numeric sample')
+    end
+    delta = delta - oldest
+end
+local total = redis.call('INCRBYFLOAT', KEYS[2], delta)
+redis.call('LPUSH', KEYS[1], ARGV[1])
+if windowLength > maxLength then
+    redis.call('RPOP', KEYS[1])
+    windowLength = windowLength - 1
+end
+return {total, windowLength}
+""")
+
+# Loaded into Redis once at startup; detectors queue plain EVALSHAs so the shared
+# pipeline does not send a SCRIPT EXISTS check ahead of every batch
+redisScripts = [fixedWindowScript, latencyWindowScript]
+
+# Each detector queues its Redis commands on a shared pipeline and returns an
+# evaluator that reads its replies (by position) from the executed pipeline.
+
 # Placeholder for a pre-trained Autoencoder model
-def getAutoEncoderReconstructionError(anomalyRequest: AnomalyRequest) -> float:
+def getAutoEncoderReconstructionError(anomalyRequest: AnomalyRequest, pipe: Pipeline) -> Callable[[list], float]:
     """Simulates an Autoencoder model by checking for high response times"""
 
     if anomalyRequest.responseTime > 50.0:
-        return 0.9 + (anomalyRequest.responseTime - 50.0) / 100.0
-    
-    schemaKey = f"schema_hashes:{anomalyRequest.endpoint}"
-    if not redisClient.sismember(schemaKey, anomalyRequest.schemaHash):
-        redisClient.sadd(schemaKey, anomalyRequest.schemaHash)
-        return 0.85
-        
-    return 0.1
-
-def checkSuddenSpikesInRequests(anomalyRequest: AnomalyRequest) -> Optional[DetectedAnomaly]:
+        reconstructionError = 0.9 + (anomalyRequest.responseTime - 50.0) / 100.0
+        return lambda results: reconstructionError
+
+    if _isSchemaConfirmed(anomalyRequest.endpoint, anomalyRequest.schemaHash):
+        return lambda results: 0.1
+
+    # SADD reports whether the hash was new, so no separate SISMEMBER is needed.
+    # The pair is only cached once Redis has replied, so a failed pipeline is retried.
+    addedIndex = len(pipe)
+    pipe.sadd(_schemaKey(anomalyRequest.endpoint), anomalyRequest.schemaHash)
+
+    def evaluate(results: list) -> float:
+        _confirmSchema(anomalyRequest.endpoint, anomalyRequest.schemaHash)
+        if results[addedIndex] == 1:
+            return 0.85
+        return 0.1
+
+    return evaluate
+
+def checkSuddenSpikesInRequests(anomalyRequest: AnomalyRequest, pipe: Pipeline) -> Callable[[list], Optional[DetectedAnomaly]]:
     """A sudden spike in the total volume of requests to an endpoint from all users combined"""
 
     timeWindowSeconds = 60
     requestRateThreshold = 10
-    currentMinute = anomalyRequest.timestamp.strftime("%Y-%m-%dT%H:%M")
-    
-    rateKey = f"rate:{anomalyRequest.endpoint}:{currentMinute}"
-    currentRate = redisClient.incr(rateKey)
-    
-    if currentRate == 1:
-        redisClient.expire(rateKey, timeWindowSeconds)
-
-    logger.info(f"Request rate check: {currentRate} requests from {anomalyRequest.authCompanyId} "
-                f"to {anomalyRequest.endpoint} in the last {timeWindowSeconds} seconds.")
-
-    if currentRate > requestRateThreshold:
-        return DetectedAnomaly(
-            type="INCREASED_REQUEST_RATE",
-            reason=f"Request rate of {currentRate} in the last minute exceeds threshold of "
-            f"{requestRateThreshold} for endpoint {anomalyRequest.endpoint}."
-        )
-    return None
-
-def checkRepetitiveRequestsByUsers(anomalyRequest: AnomalyRequest) -> Optional[DetectedAnomaly]:
+
+    rateIndex = len(pipe)
+    pipe.evalsha(fixedWindowScript.sha, 1, _rateKey(anomalyRequest.endpoint), timeWindowSeconds * 1000, requestRateThreshold)
+
+    def evaluate(results: list) -> Optional[DetectedAnomaly]:
+        currentRate, isExceeded = results[rateIndex]
+
+        logger.info("Request rate check: %d requests from %s to %s in the last %d seconds.",
+                    currentRate, anomalyRequest.authCompanyId, anomalyRequest.endpoint, timeWindowSeconds)
+
+        if isExceeded:
+            return DetectedAnomaly.model_construct(
+                type="INCREASED_REQUEST_RATE",
+                reason=f"Request rate of {currentRate} in the last minute exceeds threshold of "
+                f"{requestRateThreshold} for endpoint {anomalyRequest.endpoint}."
+            )
+        return None
+
+    return evaluate
+
+def checkRepetitiveRequestsByUsers(anomalyRequest: AnomalyRequest, pipe: Pipeline) -> Callable[[list], Optional[DetectedAnomaly]]:
     """A single user (or client) hitting an endpoint repeatedly and rapidly"""
 
     timeWindowSeconds = 60
     requestCountThreshold = 2
-    
-    key = f"repetitive:{anomalyRequest.authCompanyId}:{anomalyRequest.endpoint}"
-    anomalyTimestamp = anomalyRequest.timestamp.timestamp()
-    
-    redisClient.zadd(key, {f"{anomalyTimestamp}:{anomalyRequest.requestId}": anomalyTimestamp})
-    redisClient.zremrangebyscore(key, '-inf', anomalyTimestamp - timeWindowSeconds)
-    recentRequestsCount = redisClient.zcard(key)
-    redisClient.expire(key, timeWindowSeconds + 5)
-
-    logger.info(f"Repetitive check: {recentRequestsCount} requests from {anomalyRequest.authCompanyId} "
-                f"to {anomalyRequest.endpoint} in the last {timeWindowSeconds} seconds.")
-
-    if recentRequestsCount > requestCountThreshold:
-        return DetectedAnomaly(
-            type="REPETITIVE_REQUEST",
-            reason=f"Client IP {anomalyRequest.authCompanyId} made {recentRequestsCount} "
-            f"requests to {anomalyRequest.endpoint} in the last {timeWindowSeconds} seconds."
-        )
-    return None
-
-def checkDelayResponseSpikes(anomalyRequest: AnomalyRequest) -> Optional[DetectedAnomaly]:
+
+    key = _repetitiveKey(anomalyRequest.authCompanyId, anomalyRequest.endpoint)
+    countIndex = len(pipe)
+    pipe.evalsha(fixedWindowScript.sha, 1, key, timeWindowSeconds * 1000, requestCountThreshold)
+
+    def evaluate(results: list) -> Optional[DetectedAnomaly]:
+        recentRequestsCount, isExceeded = results[countIndex]
+
+        logger.info("Repetitive check: %d requests from %s to %s in the last %d seconds.",
+                    recentRequestsCount, anomalyRequest.authCompanyId, anomalyRequest.endpoint, timeWindowSeconds)
+
+        if isExceeded:
+            return DetectedAnomaly.model_construct(
+                type="REPETITIVE_REQUEST",
+                reason=f"Client IP {anomalyRequest.authCompanyId} made {recentRequestsCount} "
+                f"requests to {anomalyRequest.endpoint} in the last {timeWindowSeconds} seconds."
+            )
+        return None
+
+    return evaluate
+
+def checkDelayResponseSpikes(anomalyRequest: AnomalyRequest, pipe: Pipeline) -> Callable[[list], Optional[DetectedAnomaly]]:
     """Detects if the average response time for an endpoint is increasing"""
 
     requestWindowSize = 100
     latencyThreshold = 150.0  # milliseconds
 
-    key = f"latency_window:{anomalyRequest.endpoint}"
-    
-    redisClient.lpush(key, anomalyRequest.responseTime)
-    redisClient.ltrim(key, 0, requestWindowSize - 1)
+    samplesKey, sumKey = _latencyKeys(anomalyRequest.endpoint)
 
-    if redisClient.llen(key) < requestWindowSize:
-        return None
+    windowIndex = len(pipe)
+    pipe.evalsha(latencyWindowScript.sha, 2, samplesKey, sumKey, anomalyRequest.responseTime, requestWindowSize)
 
-    latencies = redisClient.lrange(key, 0, -1)
-    totalLatency = sum(float(ms) for ms in latencies)
-    averageLatency = totalLatency / len(latencies)
+    def evaluate(results: list) -> Optional[DetectedAnomaly]:
+        totalLatency, windowLength = results[windowIndex]
 
-    logger.info(f"Collective latency check for {anomalyRequest.endpoint}: "
-                f"Average is {averageLatency:.2f}ms over last {requestWindowSize} requests.")
+        if windowLength < requestWindowSize:
+            return None
 
-    if averageLatency > latencyThreshold:
-        return DetectedAnomaly(
-            type="COLLECTIVE_LATENCY_SPIKE",
-            reason=f"Average response time for {anomalyRequest.endpoint} is {averageLatency:.2f}ms, "
-                   f"exceeding the threshold of {latencyThreshold}ms."
-        )
-    return None
+        averageLatency = float(totalLatency) / windowLength
 
-def checkErrorRateSpike(anomalyRequest: AnomalyRequest) -> List[DetectedAnomaly]:
+        logger.info("Collective latency check for %s: Average is %.2fms over last %d requests.",
+                    anomalyRequest.endpoint, averageLatency, requestWindowSize)
+
+        if averageLatency > latencyThreshold:
+            return DetectedAnomaly.model_construct(
+                type="COLLECTIVE_LATENCY_SPIKE",
+                reason=f"Average response time for {anomalyRequest.endpoint} is {averageLatency:.2f}ms, "
+                       f"exceeding the threshold of {latencyThreshold}ms."
+            )
+        return None
+
+    return evaluate
+
+def checkErrorRateSpike(anomalyRequest: AnomalyRequest, pipe: Pipeline) -> Callable[[list], List[DetectedAnomaly]]:
     """Detects spikes in the rate of client-side (4xx) and server-side (5xx) errors for an endpoint."""
-    detectedAnomalies: List[DetectedAnomaly] = []
-    
+
     if anomalyRequest.statusCode < 400:
-        return detectedAnomalies
+        return lambda results: []
 
     timeWindowSeconds = 60
-    currentMinute = anomalyRequest.timestamp.strftime("%Y-%m-%dT%H:%M")
-    
-    if 400 <= anomalyRequest.statusCode < 500:
-        clientErrorThreshold = 10
-        clientRateKey = f"client_error_rate:{anomalyRequest.endpoint}:{currentMinute}"
-        currentClientErrorRate = redisClient.incr(clientRateKey)
-        
-        if currentClientErrorRate == 1:
-            redisClient.expire(clientRateKey, timeWindowSeconds)
-
-        logger.info(f"Client error rate check for {anomalyRequest.endpoint}: {currentClientErrorRate} errors in the current minute.")
-
-        if currentClientErrorRate > clientErrorThreshold:
-            detectedAnomalies.append(DetectedAnomaly(
-                type="INCREASED_CLIENT_ERROR_RATE",
-                reason=f"Client error rate (4xx) of {currentClientErrorRate} in the "
-                f"last minute exceeds threshold of {clientErrorThreshold} for endpoint {anomalyRequest.endpoint}."
-            ))
-    
-    if 500 <= anomalyRequest.statusCode < 600:
-        serverErrorThreshold = 5
-        serverRateKey = f"server_error_rate:{anomalyRequest.endpoint}:{currentMinute}"
-        currentServerErrorRate = redisClient.incr(serverRateKey)
-        
-        if currentServerErrorRate == 1:
-            redisClient.expire(serverRateKey, timeWindowSeconds)
-
-        logger.info(f"Server error rate check for {anomalyRequest.endpoint}: {currentServerErrorRate} errors in the current minute.")
-
-        if currentServerErrorRate > serverErrorThreshold:
-            detectedAnomalies.append(DetectedAnomaly(
-                type="INCREASED_SERVER_ERROR_RATE",
-                reason=f"Server error rate (5xx) of {currentServerErrorRate} in the last minute exceeds threshold of "
-                f"{serverErrorThreshold} for endpoint {anomalyRequest.endpoint}."
-            ))
-    
-    return detectedAnomalies
+    minuteBucket = int(anomalyRequest.epochSeconds // timeWindowSeconds)
+    clientErrorThreshold = 10
+    serverErrorThreshold = 5
+    isClientError = 400 <= anomalyRequest.statusCode < 500
+    isServerError = 500 <= anomalyRequest.statusCode < 600
+
+    if isClientError:
+        clientRateKey = f"client_error_rate:{anomalyRequest.endpoint}:{minuteBucket}"
+        clientRateIndex = len(pipe)
+        pipe.evalsha(fixedWindowScript.sha, 1, clientRateKey, timeWindowSeconds * 1000, clientErrorThreshold)
+
+    if isServerError:
+        serverRateKey = f"server_error_rate:{anomalyRequest.endpoint}:{minuteBucket}"
+        serverRateIndex = len(pipe)
+        pipe.evalsha(fixedWindowScript.sha, 1, serverRateKey, timeWindowSeconds * 1000, serverErrorThreshold)
+
+    def evaluate(results: list) -> List[DetectedAnomaly]:
+        detectedAnomalies: List[DetectedAnomaly] = []
+
+        if isClientError:
+            currentClientErrorRate, isClientErrorRateExceeded = results[clientRateIndex]
+
+            logger.info("Client error rate check for %s: %d errors in the current minute.",
+                        anomalyRequest.endpoint, currentClientErrorRate)
+
+            if isClientErrorRateExceeded:
+                detectedAnomalies.append(DetectedAnomaly.model_construct(
+                    type="INCREASED_CLIENT_ERROR_RATE",
+                    reason=f"Client error rate (4xx) of {currentClientErrorRate} in the "
+                    f"last minute exceeds threshold of {clientErrorThreshold} for endpoint {anomalyRequest.endpoint}."
+                ))
+
+        if isServerError:
+            currentServerErrorRate, isServerErrorRateExceeded = results[serverRateIndex]
+
+            logger.info("Server error rate check for %s: %d errors in the current minute.",
+                        anomalyRequest.endpoint, currentServerErrorRate)
+
+            if isServerErrorRateExceeded:
+                detectedAnomalies.append(DetectedAnomaly.model_construct(
+                    type="INCREASED_SERVER_ERROR_RATE",
+                    reason=f"Server error rate (5xx) of {currentServerErrorRate} in the last minute exceeds threshold of "
+                    f"{serverErrorThreshold} for endpoint {anomalyRequest.endpoint}."
+                ))
+
+        return detectedAnomalies
+
+    return evaluate
@@ -4,8 +4,16 @@ import torch.nn.functional as F
 import numpy as np
 from pydantic import BaseModel
 from transformers import AutoTokenizer, AutoModel
+from safetensors.torch import load_file
 from collections import defaultdict
 from threading import Lock
+import asyncio
+import copy
+import json
+import re
+
+# First "status=<value>" token of a log line
+STATUS_PATTERN = re.compile(r"(?:^| )status=([^ =]*)")
 
 # Pydantic model for request body
 class LogRequest(BaseModel):
@@ -16,7 +24,7 @@ class LogRequest(BaseModel):
 # ----------------------------
 class AnomalyDetectorManager:
     """A thread-safe class to manage the model, its state, and the adaptive logic."""
-    def __init__(self, model_path="app/models/anomaly_model_state.pth"):
+    def __init__(self, model_path="app/models/anomaly_model.safetensors", metadata_path="app/models/anomaly_model.json"):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
 
@@ -39,12 +47,15 @@ class AnomalyDetectorManager:
         self.criterion = nn.MSELoss()
         
         # --- Load trained state ---
+        # Tensors come from safetensors, small metadata from JSON (see app/models/exportArtifacts.py)
         try:
-            artifacts = torch.load(model_path, map_location=self.device, weights_only=False)
-            self.ae.load_state_dict(artifacts['autoencoder_state_dict'])
-            self.normals = artifacts['initial_normals'].to(self.device)
-            self.threshold = artifacts['anomaly_threshold']
-            self.dynamic_known_endpoints = artifacts['known_endpoints']
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+            tensors = load_file(model_path, device=str(self.device))
+            self.normals = tensors.pop('initial_normals')
+            self.ae.load_state_dict(tensors)
+            self.threshold = metadata['anomaly_threshold']
+            self.dynamic_known_endpoints = set(metadata['known_endpoints'])
             self.ae.eval()
             print("✅ Model artifacts loaded successfully.")
         except FileNotFoundError:
@@ -57,13 +68,75 @@ class AnomalyDetectorManager:
         self.new_endpoint_buffer = defaultdict(list)
         self.PROMOTE_BUFFER_SIZE = 50
         self.lock = Lock() # For thread-safe updates to the model state
-
-    def get_embedding(self, text: str):
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding="max_length", max_length=64).to(self.device)
+        self.fine_tune_lock = Lock() # Serializes promotions without blocking buffering or scoring
+
+        # --- Dynamic batching of concurrent embedding requests ---
+        self.EMBED_BATCH_SIZE = 32
+        self.EMBED_BATCH_WAIT_SECONDS = 0.005
+        self.embed_queue = asyncio.Queue()
+        self.embed_worker = None
+
+    def start(self):
+        if self.embed_worker is None:
+            self.embed_worker = asyncio.create_task(self.run_embed_batches())
+
+    async def stop(self):
+        if self.embed_worker is None:
+            return
+        self.embed_worker.cancel()
+        try:
+            await self.embed_worker
+        except asyncio.CancelledError:
+            pass
+        self.embed_worker = None
+
+    def get_embeddings(self, texts: list):
+        # Fixed max_length padding and an unquantized encoder keep each embedding independent
+        # of the rest of its batch; dynamic int8 quantization would share one activation scale
+        # across the batch and make rows depend on each other
+        inputs = self.tokenizer(texts, return_tensors="pt", truncation=True, padding="max_length", max_length=64).to(self.device)
         with torch.no_grad():
             outputs = self.encoder_model(**inputs)
-            mean_vec = outputs.last_hidden_state.mean(dim=1)
-        return mean_vec.squeeze(0)
+            mean_vecs = outputs.last_hidden_state.mean(dim=1)
+        return mean_vecs
+
+    def embed_and_detect(self, texts: list):
+        embs = self.get_embeddings(texts)
+        return embs, self.detect(embs)
+
+    async def run_embed_batches(self):
+        """Collects up to EMBED_BATCH_SIZE texts (waiting at most EMBED_BATCH_WAIT_SECONDS) per forward pass."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.embed_queue.get()]
+            deadline = loop.time() + self.EMBED_BATCH_WAIT_SECONDS
+            while len(batch) < self.EMBED_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.embed_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                # The forward pass is blocking, keep it off the event loop
+                embs, errs = await asyncio.to_thread(self.embed_and_detect, [text for text, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((embs[i], errs[i]))
+
+    async def embed(self, text: str):
+        """Returns the embedding of text and its reconstruction error, computed in a shared batch."""
+        future = asyncio.get_running_loop().create_future()
+        await self.embed_queue.put((text, future))
+        return await future
 
     def detect(self, emb_tensor):
         self.ae.eval()
@@ -72,60 +145,75 @@ class AnomalyDetectorManager:
             err = F.mse_loss(recon, emb_tensor.to(self.device), reduction="none").mean(dim=1)
         return err.cpu().numpy()
 
-    def handle_incoming_log(self, text: str):
+    async def handle_incoming_log(self, text: str):
         if not self.ae:
             return {"error": "Model not loaded."}
             
-        endpoint = text.split(" ")[0].replace("endpoint=", "")
-        status_strs = [x.split("=")[1] for x in text.split(" ") if x.startswith("status=")]
-        status = int(status_strs[0]) if status_strs else 200
+        endpoint = text.partition(" ")[0].replace("endpoint=", "")
+        status_match = STATUS_PATTERN.search(text)
+        status = int(status_match.group(1)) if status_match else 200
 
-        emb = self.get_embedding(text).unsqueeze(0)
-        err = self.detect(emb)[0]
+        emb, err = await self.embed(text)
 
         if endpoint in self.dynamic_known_endpoints:
             pred = "normal" if err <= self.threshold else "anomaly"
             return {"log": text, "recon_error": float(err), "decision": pred, "status": "known_endpoint"}
 
+        # Buffering may trigger fine-tuning, which must not block the event loop
+        return await asyncio.to_thread(self.adapt_to_unknown_endpoint, text, endpoint, status, emb, err)
+
+    def adapt_to_unknown_endpoint(self, text: str, endpoint: str, status: int, emb, err):
         # --- Adaptive Logic for Unknown Endpoints ---
-        # This part modifies the shared state, so we use a lock
+        if status != 200: # Unknown endpoint with error status
+            return {"log": text, "recon_error": float(err), "decision": "anomaly", "status": "unknown_endpoint_error"}
+
+        pred = "normal"
+
+        # Buffering modifies the shared state, so we use a lock, but only briefly
         with self.lock:
-            if status == 200:
-                self.new_endpoint_buffer[endpoint].append(emb.squeeze(0))
-                pred = "normal"
-
-                if len(self.new_endpoint_buffer[endpoint]) >= self.PROMOTE_BUFFER_SIZE:
-                    print(f"Promoting {endpoint} and fine-tuning AE...")
-                    self.dynamic_known_endpoints.add(endpoint)
-                    
-                    new_embeds = torch.stack(self.new_endpoint_buffer[endpoint]).to(self.device)
-                    self.normals = torch.cat([self.normals, new_embeds])
-
-                    # Fine-tune
-                    optimizer = torch.optim.Adam(self.ae.parameters(), lr=1e-4) # Use a smaller learning rate
-                    self.ae.train()
-                    for _ in range(5):
-                        optimizer.zero_grad()
-                        recon = self.ae(self.normals)
-                        loss = self.criterion(recon, self.normals)
-                        loss.backward()
-                        optimizer.step()
-                    
-                    # Recompute threshold
-                    self.ae.eval()
-                    with torch.no_grad():
-                        recon = self.ae(self.normals)
-                        errs = F.mse_loss(recon, self.normals, reduction="none").mean(dim=1).cpu().numpy()
-                    self.threshold = np.percentile(errs, 95)
-                    print(f"Updated anomaly threshold: {self.threshold:.6f}")
-
-                    self.new_endpoint_buffer[endpoint] = [] # Clear buffer
-                    status_msg = f"endpoint_promoted_and_model_retrained"
-                else:
-                    status_msg = f"endpoint_buffered ({len(self.new_endpoint_buffer[endpoint])}/{self.PROMOTE_BUFFER_SIZE})"
-
-            else: # Unknown endpoint with error status
-                pred = "anomaly"
-                status_msg = "unknown_endpoint_error"
-        
+            self.new_endpoint_buffer[endpoint].append(emb.clone()) # Don't pin the whole batch tensor
+            buffered = len(self.new_endpoint_buffer[endpoint])
+            promote = buffered >= self.PROMOTE_BUFFER_SIZE
+            if promote:
+                new_embeds = torch.stack(self.new_endpoint_buffer[endpoint]).to(self.device)
+                self.new_endpoint_buffer[endpoint] = [] # Clear buffer
+
+        if not promote:
+            status_msg = f"endpoint_buffered ({buffered}/{self.PROMOTE_BUFFER_SIZE})"
+            return {"log": text, "recon_error": float(err), "decision": pred, "status": status_msg}
+
+        # One promotion at a time, so each fine-tune starts from the previously published weights
+        with self.fine_tune_lock:
+            print(f"Promoting {endpoint} and fine-tuning AE...")
+            with self.lock:
+                normals = torch.cat([self.normals, new_embeds])
+                ae = copy.deepcopy(self.ae)
+
+            # Fine-tune a private copy; requests keep scoring against the published model meanwhile
+            optimizer = torch.optim.Adam(ae.parameters(), lr=1e-4) # Use a smaller learning rate
+            ae.train()
+            for _ in range(5):
+                optimizer.zero_grad()
+                recon = ae(normals)
+                loss = self.criterion(recon, normals)
+                loss.backward()
+                optimizer.step()
+
+            # Recompute threshold
+            ae.eval()
+            with torch.no_grad():
+                recon = ae(normals)
+                errs = F.mse_loss(recon, normals, reduction="none").mean(dim=1).cpu().numpy()
+            threshold = np.percentile(errs, 95)
+
+            # Publish the retrained model
+            with self.lock:
+                self.ae.load_state_dict(ae.state_dict())
+                self.threshold = threshold
+                self.normals = normals
+                self.dynamic_known_endpoints.add(endpoint)
+                self.new_endpoint_buffer.pop(endpoint, None) # Logs buffered while fine-tuning are now known
+            print(f"Updated anomaly threshold: {self.threshold:.6f}")
+
+        status_msg = f"endpoint_promoted_and_model_retrained"
         return {"log": text, "recon_error": float(err), "decision": pred, "status": status_msg}
\ No newline at end of file
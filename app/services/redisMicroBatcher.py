@@ -0,0 +1,117 @@
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, TypeVar
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.commands.core import AsyncScript
+from redis.exceptions import NoScriptError
+from app.config.redis import redisClient
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class RedisMicroBatcher:
+    """Coalesces the Redis commands of concurrent requests into shared pipelines.
+
+    A single worker keeps one pipeline in flight; whatever is submitted while it
+    executes is sent together as the next pipeline, so batches form without a timer.
+    A batch is capped at maxBatchSize requests so one huge pipeline cannot stall the rest.
+    """
+    def __init__(self, client: Redis, maxBatchSize: int = 256):
+        self.client = client
+        self.maxBatchSize = maxBatchSize
+        self.queue: "asyncio.Queue[Tuple[Callable[[Pipeline], Awaitable[Any]], asyncio.Future]]" = asyncio.Queue()
+        self.worker: Optional[asyncio.Task] = None
+        self.scripts: List[AsyncScript] = []
+
+    def start(self):
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+
+    async def loadScripts(self, scripts: List[AsyncScript]):
+        """Loads scripts into Redis so submitted commands can call them by EVALSHA"""
+        self.scripts = list(scripts)
+        for script in self.scripts:
+            script.sha = await self.client.script_load(script.script)
+
+    async def submit(self, queueCommands: Callable[[Pipeline], Awaitable[T]]) -> Tuple[T, list]:
+        """
+        Queues commands on the next shared pipeline. Returns what queueCommands returned
+        together with the full results of that pipeline, indexed by position in it.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((queueCommands, future))
+        return await future
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < self.maxBatchSize:
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.flush(batch)
+            except Exception as error:
+                logger.error("Redis pipeline of %d requests failed: %s", len(batch), error)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    async def flush(self, batch: List[Tuple[Callable[[Pipeline], Awaitable[Any]], asyncio.Future]]):
+        queued = []
+        async with self.client.pipeline(transaction=False) as pipe:
+            for queueCommands, future in batch:
+                start = len(pipe)
+                try:
+                    value = await queueCommands(pipe)
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+                queued.append((future, value, start, len(pipe)))
+
+            if not queued:
+                return
+
+            commands = list(pipe.command_stack)
+            results = await pipe.execute(raise_on_error=False)
+
+        missing = [index for index, result in enumerate(results) if isinstance(result, NoScriptError)]
+        if missing:
+            results = await self.replayMissingScripts(commands, results, missing)
+
+        # A failed command only fails the request that queued it
+        for future, value, start, end in queued:
+            if future.done():
+                continue
+            error = next((result for result in results[start:end] if isinstance(result, Exception)), None)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result((value, results))
+
+    async def replayMissingScripts(self, commands: list, results: list, missing: List[int]) -> list:
+        """Reloads scripts Redis has lost (e.g. after a restart) and replays the EVALSHAs that failed"""
+        logger.warning("Redis is missing preloaded scripts; reloading them and replaying %d commands", len(missing))
+        await self.loadScripts(self.scripts)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for index in missing:
+                args, options = commands[index]
+                pipe.execute_command(*args, **options)
+            replayed = await pipe.execute(raise_on_error=False)
+        results = list(results)
+        for index, result in zip(missing, replayed):
+            results[index] = result
+        return results
+
+redisBatcher = RedisMicroBatcher(redisClient)
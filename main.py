@@ -1,17 +1,51 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
 from app.api.v1 import endpoints
 from app.config.logs import setup_logging
+from app.config.redis import redisPool
+from app.services.redisMicroBatcher import redisBatcher
+from app.services import anomalyDetector
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 import uvicorn
+import logging
+import os
+import sys
 
 setup_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await redisBatcher.loadScripts(anomalyDetector.redisScripts)
+    except (RedisConnectionError, RedisTimeoutError) as error:
+        # Start without Redis; the first batch that hits NOSCRIPT loads the scripts
+        logger.warning("Could not preload Redis scripts, deferring to the first batch: %s", error)
+    redisBatcher.start()
+    endpoints.model_manager.start()
+    yield
+    await endpoints.model_manager.stop()
+    await redisBatcher.stop()
+    await redisPool.aclose()
 
 app = FastAPI(
     title="Anomaly Detection Service",
     description="A service to detect anomalies in API traffic.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 app.include_router(endpoints.router, prefix="/api/v1")
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if os.getenv("DEV") == "1":
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        # One worker by default: adaptive learning state lives in each worker's process
+        workers = int(os.getenv("WORKERS", "1"))
+        if workers > 1:
+            # Split the cores between the workers' torch thread pools instead of oversubscribing them
+            os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, loop="uvloop" if sys.platform != "win32" else "asyncio", http="httptools", workers=workers)